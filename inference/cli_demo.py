@@ -13,7 +13,10 @@ Run the script:
 import argparse
 import torch
 import csv
+import json
 import os
+import sys
+from typing import Iterable
 from diffusers import CogVideoXPipeline, CogVideoXDDIMScheduler, CogVideoXDPMScheduler
 from diffusers.utils import export_to_video
 
@@ -78,31 +81,41 @@ def generate_video(
     # 5. Export the generated frames to a video file. fps must be 8 for original video.
     export_to_video(video, output_path, fps=8)
 
+def process_prompts(prompts: Iterable[dict], model_path: str, num_inference_steps: int, guidance_scale: float, num_videos_per_prompt: int, dtype: torch.dtype):
+    for row in prompts:
+        prompt = row['prompt']
+        output_path = row['output_path']
+        if os.path.exists(output_path):
+            print(f"Video already exists at {output_path}. Skipping generation.")
+            continue
+        print(f"Generating video for prompt: {prompt}")
+        generate_video(
+            prompt=prompt,
+            model_path=model_path,
+            output_path=output_path,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            num_videos_per_prompt=num_videos_per_prompt,
+            dtype=dtype,
+        )
+        print(f"Video saved to: {output_path}")
+
 def process_csv(csv_file: str, model_path: str, num_inference_steps: int, guidance_scale: float, num_videos_per_prompt: int, dtype: torch.dtype):
-    with open(csv_file, 'r') as file:
-        csv_reader = csv.DictReader(file)
-        for row in csv_reader:
-            prompt = row['prompt']
-            output_path = row['output_path']
-            if os.path.exists(output_path):
-                print(f"Video already exists at {output_path}. Skipping generation.")
-                continue
-            print(f"Generating video for prompt: {prompt}")
-            generate_video(
-                prompt=prompt,
-                model_path=model_path,
-                output_path=output_path,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                num_videos_per_prompt=num_videos_per_prompt,
-                dtype=dtype,
-            )
-            print(f"Video saved to: {output_path}")
+    with open(csv_file, 'r', newline='') as file:
+        process_prompts(csv.DictReader(file), model_path, num_inference_steps, guidance_scale, num_videos_per_prompt, dtype)
+
+def process_stdin(model_path: str, num_inference_steps: int, guidance_scale: float, num_videos_per_prompt: int, dtype: torch.dtype):
+    # One JSON object per line with the same keys as the CSV columns
+    rows = (json.loads(line) for line in sys.stdin if line.strip())
+    process_prompts(rows, model_path, num_inference_steps, guidance_scale, num_videos_per_prompt, dtype)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate videos from text prompts using CogVideoX")
     parser.add_argument("--prompt", type=str, help="The description of the video to be generated")
     parser.add_argument("--prompts", type=str, help="Path to a CSV file containing prompts and output paths")
+    parser.add_argument(
+        "--prompts_stdin", action="store_true", help="Read newline-delimited JSON prompts and output paths from stdin"
+    )
     parser.add_argument(
         "--model_path", type=str, default="THUDM/CogVideoX-5b", help="The path of the pre-trained model to be used"
     )
@@ -133,6 +146,15 @@ if __name__ == "__main__":
             num_videos_per_prompt=args.num_videos_per_prompt,
             dtype=dtype,
         )
+    elif args.prompts_stdin:
+        # Process prompts piped in by run_batch.py
+        process_stdin(
+            model_path=args.model_path,
+            num_inference_steps=args.num_inference_steps,
+            guidance_scale=args.guidance_scale,
+            num_videos_per_prompt=args.num_videos_per_prompt,
+            dtype=dtype,
+        )
     elif args.prompt:
         # Generate a single video
         generate_video(
@@ -145,5 +167,5 @@ if __name__ == "__main__":
             dtype=dtype,
         )
     else:
-        print("Error: Either --prompt or --prompts must be provided.")
+        print("Error: One of --prompt, --prompts or --prompts_stdin must be provided.")
         parser.print_help()
@@ -1,115 +1,494 @@
+import asyncio
+import logging
+import mimetypes
 import os
-from typing import List
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from typing import BinaryIO, Dict, List, Optional, Tuple
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+import anyio
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.wsgi import WSGIMiddleware
-from starlette.responses import HTMLResponse
-import dash
-from dash import html, dcc, Input, Output, State, clientside_callback
-import dash_bootstrap_components as dbc
+from starlette.background import BackgroundTask
+from starlette.responses import HTMLResponse, PlainTextResponse
+from starlette.types import Receive, Scope, Send
 
-# Initialize FastAPI
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Per-process setup lives here rather than at import: with several workers, uvicorn's spawned
+    # processes also execute this file as __mp_main__, and that copy should create nothing
+    global MAX_OPEN_VIDEOS, FD_SEM
+    MAX_OPEN_VIDEOS = _max_open_videos()
+    FD_SEM = asyncio.Semaphore(MAX_OPEN_VIDEOS)
+    if dash_proxy is not None:
+        dash_proxy.start()
+    yield
+    if dash_proxy is not None:
+        await dash_proxy.aclose()
 
-# Initialize Dash with a dark theme
-dash_app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY], requests_pathname_prefix="/dash/")
+# Initialize FastAPI
+app = FastAPI(lifespan=lifespan)
 
 # Define the directory where your video folders are located
 VIDEO_DIR = './batches/'
+VIDEO_ROOT = os.path.realpath(VIDEO_DIR)
+
+logger = logging.getLogger(__name__)
+
+def _max_open_videos() -> int:
+    # Cap the number of video files open at once so a burst of viewers queues instead of hitting EMFILE
+    if resource is None:
+        return 512
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return 512
+    max_open = min(512, max(64, soft // 2))
+    if soft < 4096:
+        logger.warning(
+            f"Open file limit is {soft}; raise it (ulimit -n) to serve many concurrent viewers. "
+            f"Streaming at most {max_open} videos at once."
+        )
+    return max_open
+
+# Set by lifespan once the server starts
+MAX_OPEN_VIDEOS = 512
+FD_SEM: Optional[asyncio.Semaphore] = None
+# Set while every slot is taken, so saturation is logged once per episode rather than per request
+_fd_sem_saturated = False
+
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov'}
+
+@lru_cache(maxsize=256)
+def _list_dir_cached(path: str, mtime_ns: int, dirs: bool) -> Tuple[str, ...]:
+    # mtime_ns is part of the cache key, so adding or removing an entry invalidates it
+    with os.scandir(path) as it:
+        if dirs:
+            names = [entry.name for entry in it if entry.is_dir()]
+        else:
+            names = [
+                entry.name for entry in it
+                if entry.is_file() and entry.name.rpartition('.')[2].lower() in VIDEO_EXTENSIONS
+            ]
+    names.sort()
+    return tuple(names)
 
 def get_playlists() -> List[str]:
-    return sorted([folder for folder in os.listdir(VIDEO_DIR) if os.path.isdir(os.path.join(VIDEO_DIR, folder))])
+    return list(_list_dir_cached(VIDEO_DIR, os.stat(VIDEO_DIR).st_mtime_ns, True))
+
+# Videos that may be served: playlist -> (listing, {video: absolute path})
+_allowed_videos: Dict[str, Tuple[Tuple[str, ...], Dict[str, str]]] = {}
 
 def get_videos(playlist: str) -> List[str]:
     playlist_dir = os.path.join(VIDEO_DIR, playlist)
-    return sorted([video for video in os.listdir(playlist_dir) if video.endswith(('.mp4', '.avi', '.mov'))])
-
-# Dash app layout
-dash_app.layout = dbc.Container([
-    html.H1("Video Playlist App", className="my-4"),
-    dbc.Row([
-        dbc.Col([
-            dcc.Dropdown(
-                id='playlist-dropdown',
-                options=[{'label': playlist, 'value': playlist} for playlist in get_playlists()],
-                placeholder="Select a playlist",
-                className="mb-3"
-            ),
-            html.Div(id='video-list')
-        ], width=3),
-        dbc.Col([
-            html.Video(id='video-player', controls=True, autoPlay=True, style={'width': '100%'}),
-            dbc.Button("Next Video", id='next-video-button', n_clicks=0, className="mt-3")
-        ], width=9)
-    ]),
-    dcc.Store(id='current-playlist'),
-    dcc.Store(id='current-video-index')
-], fluid=True, className="p-5")
-
-@dash_app.callback(
-    Output('video-list', 'children'),
-    Output('current-playlist', 'data'),
-    Input('playlist-dropdown', 'value')
-)
-def update_video_list(selected_playlist):
-    if not selected_playlist:
-        return [], None
-    videos = get_videos(selected_playlist)
-    return [html.Li(video, className="list-group-item") for video in videos], selected_playlist
-
-@dash_app.callback(
-    Output('video-player', 'src'),
-    Output('current-video-index', 'data'),
-    Input('playlist-dropdown', 'value'),
-    Input('next-video-button', 'n_clicks'),
-    Input('video-player', 'ended'),
-    State('current-playlist', 'data'),
-    State('current-video-index', 'data')
-)
-def update_video_player(selected_playlist, n_clicks, video_ended, current_playlist, current_index):
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return dash.no_update, dash.no_update
+    videos = _list_dir_cached(playlist_dir, os.stat(playlist_dir).st_mtime_ns, False)
+    allowed = _allowed_videos.get(playlist)
+    if allowed is None or allowed[0] is not videos:
+        # The listing changed, so resolve its paths again
+        _allowed_videos[playlist] = (videos, _resolve_videos(playlist, videos))
+    return list(videos)
+
+def _resolve_videos(playlist: str, videos: Tuple[str, ...]) -> Dict[str, str]:
+    paths = {}
+    for video in videos:
+        path = os.path.realpath(os.path.join(VIDEO_DIR, playlist, video))
+        # Skip symlinks that point outside VIDEO_DIR
+        if path.startswith(VIDEO_ROOT + os.sep):
+            paths[video] = path
+    return paths
+
+def _lookup_video(playlist: str, video: str) -> Optional[str]:
+    allowed = _allowed_videos.get(playlist)
+    if allowed is None:
+        return None
+    return allowed[1].get(video)
+
+# Dropdown options are shared by every session and rebuilt only when VIDEO_DIR changes
+@lru_cache(maxsize=1)
+def _playlist_options_cached(mtime_ns: int) -> Tuple[dict, ...]:
+    return tuple({'label': playlist, 'value': playlist} for playlist in get_playlists())
+
+def get_playlist_options() -> List[dict]:
+    return list(_playlist_options_cached(os.stat(VIDEO_DIR).st_mtime_ns))
+
+def clear_listing_caches():
+    _playlist_options_cached.cache_clear()
+    _list_dir_cached.cache_clear()
+    _allowed_videos.clear()
 
-    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
+def _build_dash():
+    # Dash is imported and laid out on first use so processes that only stream videos skip its startup cost
+    import dash
+    from dash import html, dcc, Input, Output, State
+    import dash_bootstrap_components as dbc
+
+    # Initialize Dash with a dark theme
+    dash_app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY], requests_pathname_prefix="/dash/")
+
+    # Dash app layout
+    dash_app.layout = dbc.Container([
+        html.H1("Video Playlist App", className="my-4"),
+        dbc.Row([
+            dbc.Col([
+                dcc.Dropdown(
+                    id='playlist-dropdown',
+                    options=[],
+                    placeholder="Select a playlist",
+                    className="mb-3"
+                ),
+                dbc.Button("Refresh", id='refresh-button', n_clicks=0, color="secondary", size="sm", className="mb-3"),
+                html.Div(id='video-list')
+            ], width=3),
+            dbc.Col([
+                html.Video(id='video-player', controls=True, autoPlay=True, style={'width': '100%'}),
+                dbc.Button("Next Video", id='next-video-button', n_clicks=0, className="mt-3")
+            ], width=9)
+        ]),
+        dcc.Store(id='current-playlist'),
+        dcc.Store(id='current-video-index'),
+        dcc.Store(id='ended-listener')
+    ], fluid=True, className="p-5")
+
+    @dash_app.callback(
+        Output('playlist-dropdown', 'options'),
+        Input('refresh-button', 'n_clicks')
+    )
+    def refresh_playlists(n_clicks):
+        # Runs on every page load, so new batches show up without restarting the app
+        if dash.callback_context.triggered:
+            # Explicit refresh: drop every cached listing, e.g. after files were replaced in place.
+            # With several uvicorn workers this clears only the worker that handled the click; the others
+            # still pick up added or removed files through the mtime-keyed caches
+            clear_listing_caches()
+        return get_playlist_options()
+
+    @dash_app.callback(
+        Output('video-list', 'children'),
+        Output('current-playlist', 'data'),
+        Input('playlist-dropdown', 'value')
+    )
+    def update_video_list(selected_playlist):
+        if not selected_playlist:
+            return [], None
+        videos = get_videos(selected_playlist)
+        return (
+            [html.Li(video, className="list-group-item") for video in videos],
+            {'playlist': selected_playlist, 'videos': videos},
+        )
+
+    @dash_app.callback(
+        Output('video-player', 'src'),
+        Output('current-video-index', 'data'),
+        Input('playlist-dropdown', 'value')
+    )
+    def update_video_player(selected_playlist):
+        # Only playlist changes reach the server; next/ended are handled clientside below
+        ctx = dash.callback_context
+        if not ctx.triggered or not selected_playlist:
+            return dash.no_update, dash.no_update
 
-    if trigger_id == 'playlist-dropdown' and selected_playlist:
         videos = get_videos(selected_playlist)
         if videos:
             return f"/videos/{selected_playlist}/{videos[0]}", 0
-    elif (trigger_id in ['next-video-button', 'video-player']) and current_playlist:
-        videos = get_videos(current_playlist)
-        if current_index is None:
-            current_index = 0
-        else:
-            current_index = (current_index + 1) % len(videos)
-        return f"/videos/{current_playlist}/{videos[current_index]}", current_index
 
-    return dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update
 
-# Client-side callback to handle video ended event
-clientside_callback(
-    """
-    function(ended) {
-        if (ended) {
-            document.getElementById('next-video-button').click();
+    # html.Video has no `ended` prop, so hook the DOM event once and route it through the Next button
+    dash_app.clientside_callback(
+        """
+        function(id) {
+            const video = document.getElementById(id);
+            if (video && !video.dataset.endedListener) {
+                video.addEventListener('ended', function() {
+                    document.getElementById('next-video-button').click();
+                });
+                video.dataset.endedListener = 'true';
+            }
+            return true;
         }
-    }
-    """,
-    Output('video-player', 'ended'),
-    Input('video-player', 'ended')
-)
+        """,
+        Output('ended-listener', 'data'),
+        Input('video-player', 'id')
+    )
+
+    # Client-side callback to advance to the next video on button click or when one ends, without a server round-trip
+    dash_app.clientside_callback(
+        """
+        function(n_clicks, store, index) {
+            const no_update = window.dash_clientside.no_update;
+            if (!store || !store.videos || !store.videos.length) {
+                return [no_update, no_update];
+            }
+            const i = (index === null || index === undefined) ? 0 : (index + 1) % store.videos.length;
+            return ['/videos/' + store.playlist + '/' + store.videos[i], i];
+        }
+        """,
+        Output('video-player', 'src', allow_duplicate=True),
+        Output('current-video-index', 'data', allow_duplicate=True),
+        Input('next-video-button', 'n_clicks'),
+        State('current-playlist', 'data'),
+        State('current-video-index', 'data'),
+        prevent_initial_call=True
+    )
+
+    return dash_app
+
+class LazyDashApp:
+    # ASGI app mounted at /dash that builds the Dash app on the first request
+    def __init__(self):
+        self._app = None
+        self._lock = asyncio.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self._app is None:
+            async with self._lock:
+                if self._app is None:
+                    dash_app = await anyio.to_thread.run_sync(_build_dash)
+                    self._app = WSGIMiddleware(dash_app.server)
+        await self._app(scope, receive, send)
+
+def build_dash_server():
+    # WSGI entry point for running Dash in its own processes, e.g.
+    #   gunicorn --workers 4 --bind 127.0.0.1:8050 "player:build_dash_server()"
+    return _build_dash().server
+
+# Set DASH_UPSTREAM (e.g. http://127.0.0.1:8050) to proxy /dash to a separate Dash server
+DASH_UPSTREAM = os.environ.get("DASH_UPSTREAM")
+
+# Hop-by-hop headers are per connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade",
+}
+
+class DashProxy:
+    # ASGI app mounted at /dash that forwards requests to DASH_UPSTREAM, so Dash
+    # callbacks run in other processes instead of the WSGI thread pool of this one
+    def __init__(self, upstream: str):
+        self._upstream = upstream
+        self._client = None
+
+    def start(self) -> None:
+        # Called from lifespan so only the process actually serving requests opens a client
+        import httpx
+
+        self._http_error = httpx.HTTPError
+        self._client = httpx.AsyncClient(base_url=self._upstream, timeout=None)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request = Request(scope, receive)
+        # The upstream app serves its routes at / (only requests_pathname_prefix is /dash/),
+        # so strip the mount prefix that raw_path still carries
+        url = scope.get("raw_path", b"").decode("latin-1") or scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and url.startswith(root_path):
+            url = url[len(root_path):] or "/"
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode("latin-1")
+        headers = [
+            (key, value) for key, value in request.headers.raw
+            if key.decode("latin-1").lower() not in HOP_BY_HOP_HEADERS | {"host"}
+        ]
+        upstream_request = self._client.build_request(request.method, url, headers=headers, content=request.stream())
+        try:
+            upstream_response = await self._client.send(upstream_request, stream=True)
+        except self._http_error as e:
+            logger.error(f"Dash upstream {DASH_UPSTREAM} unavailable: {str(e)}")
+            await PlainTextResponse("Bad Gateway", status_code=502)(scope, receive, send)
+            return
+        response = StreamingResponse(
+            upstream_response.aiter_raw(),
+            status_code=upstream_response.status_code,
+            background=BackgroundTask(upstream_response.aclose),
+        )
+        response.raw_headers = [
+            (key, value) for key, value in upstream_response.headers.raw
+            if key.decode("latin-1").lower() not in HOP_BY_HOP_HEADERS
+        ]
+        await response(scope, receive, send)
+
+# Range request helpers
+CHUNK_SIZE = 64 * 1024
+
+def send_bytes_range_requests(file_obj: BinaryIO, start: int, end: int, chunk_size: int = CHUNK_SIZE):
+    # Yield only the bytes in [start, end] so seeks don't re-read the whole file
+    with file_obj as f:
+        f.seek(start)
+        while (pos := f.tell()) <= end:
+            read_size = min(chunk_size, end + 1 - pos)
+            data = f.read(read_size)
+            if not data:
+                break
+            yield data
+
+def _is_bytes_range(range_header: str) -> bool:
+    # Other range units must be ignored and the full representation served (RFC 9110 14.2)
+    return range_header.partition("=")[0].strip().lower() == "bytes"
+
+def _get_range_header(range_header: str, file_size: int) -> Tuple[int, int]:
+    def _invalid_range():
+        return HTTPException(
+            status_code=416,
+            detail=f"Invalid request range (Range:{range_header!r})",
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+
+    try:
+        byte_range = range_header.partition("=")[2]
+        # Only the first range of a multi-range request is served
+        h = byte_range.split(",")[0].strip().split("-")
+        if h[0]:
+            start = int(h[0])
+            end = int(h[1]) if h[1] else file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(file_size - int(h[1]), 0)
+            end = file_size - 1
+    except (ValueError, IndexError):
+        raise _invalid_range()
+
+    end = min(end, file_size - 1)
+    if start > end or start < 0:
+        raise _invalid_range()
+    return start, end
+
+class ZeroCopyFileResponse(Response):
+    # Sends [start, end] of a file with the ASGI zero-copy extension when the
+    # server offers it, so the kernel splices the file straight into the socket.
+    # Servers without the extension get the chunked streaming path instead.
+    def __init__(self, path: str, start: int, end: int, status_code: int = 200, headers=None, media_type=None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        global _fd_sem_saturated
+        if FD_SEM.locked():
+            if not _fd_sem_saturated:
+                logger.warning(f"All {MAX_OPEN_VIDEOS} video slots are in use; queueing streams until one closes")
+                _fd_sem_saturated = True
+        elif _fd_sem_saturated:
+            logger.info("Video slots available again")
+            _fd_sem_saturated = False
+        # The slot is held until the response body has been fully sent
+        async with FD_SEM:
+            await self._send_file(scope, receive, send)
+
+    async def _send_file(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Open once, off the event loop, and hand the same descriptor to whichever path applies
+        f = await anyio.to_thread.run_sync(open, self.path, "rb")
+        with f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                # A seek becomes a single sendfile over [start, end]
+                await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.end - self.start + 1,
+                    "more_body": False,
+                })
+                return
+
+            fallback = StreamingResponse(
+                send_bytes_range_requests(f, self.start, self.end),
+                status_code=self.status_code,
+                media_type=self.media_type,
+            )
+            fallback.raw_headers = self.raw_headers
+            await fallback(scope, receive, send)
+
+def _find_video(playlist: str, video: str) -> Optional[str]:
+    # Slow path on a cache miss. Only names that are real playlists get listed, so
+    # traversal attempts like ".." are rejected without touching the requested path
+    if playlist not in get_playlists():
+        return None
+    get_videos(playlist)
+    return _lookup_video(playlist, video)
+
+def _stat_video(playlist: str, video: str) -> Optional[Tuple[str, os.stat_result]]:
+    # Runs in a worker thread: every filesystem call for a request happens here, off the event loop
+    video_path = _lookup_video(playlist, video) or _find_video(playlist, video)
+    if video_path is None:
+        return None
+    try:
+        return video_path, os.stat(video_path)
+    except FileNotFoundError:
+        # Removed since the listing was cached
+        _allowed_videos.pop(playlist, None)
+        return None
+
+def _is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one-second resolution
+        return int(mtime) <= since
+    return False
 
 # FastAPI routes
 @app.get("/videos/{playlist}/{video}")
-async def get_video(playlist: str, video: str):
-    video_path = os.path.join(VIDEO_DIR, playlist, video)
-    if not os.path.exists(video_path):
+async def get_video(request: Request, playlist: str, video: str):
+    found = await anyio.to_thread.run_sync(_stat_video, playlist, video)
+    if found is None:
         raise HTTPException(status_code=404, detail="Video not found")
-    return FileResponse(video_path)
+
+    video_path, stat_result = found
+    file_size = stat_result.st_size
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{stat_result.st_mtime_ns:x}-{file_size:x}"',
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+    }
+    if _is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+        # The client's cached copy is current, so nothing is re-sent
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    start, end = 0, file_size - 1
+    status_code = 200
+
+    if range_header is not None and _is_bytes_range(range_header):
+        start, end = _get_range_header(range_header, file_size)
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        status_code = 206
+
+    headers["Content-Length"] = str(end - start + 1)
+    return ZeroCopyFileResponse(
+        video_path,
+        start,
+        end,
+        headers=headers,
+        status_code=status_code,
+        media_type=mimetypes.guess_type(video_path)[0] or "video/mp4",
+    )
 
 # Mount Dash app
-app.mount("/dash", WSGIMiddleware(dash_app.server))
+# The proxy's client is closed by lifespan on shutdown
+dash_proxy = DashProxy(DASH_UPSTREAM) if DASH_UPSTREAM else None
+if dash_proxy is not None:
+    app.mount("/dash", dash_proxy)
+else:
+    app.mount("/dash", LazyDashApp())
 
 @app.get("/")
 async def read_root():
@@ -147,4 +526,10 @@ async def read_root():
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Module-level code runs twice per spawned worker (as __mp_main__ and as player), so per-process
+    # resources are created in lifespan. Equivalent: `uvicorn player:app --workers N` from inference/.
+    # "auto" picks uvloop and httptools when they are installed and falls back to asyncio/h11 otherwise (e.g. Windows).
+    # Multiple workers need the app as an import string, which resolves because this script's directory
+    # (inference/) is on sys.path; run it as `python player.py`, not as a module from elsewhere.
+    # Each worker keeps its own listing caches and open-file semaphore.
+    uvicorn.run("player:app", host="0.0.0.0", port=8000, loop="auto", http="auto", workers=os.cpu_count())